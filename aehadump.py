@@ -14,14 +14,21 @@ def chunks(l, n):
         yield l[i:i + n]
 
 parser = argparse.ArgumentParser()
-parser.add_argument('-t', '--periodic_time', type=float, required=True)
+parser.add_argument('-t', '--periodic_time', type=float)
 parser.add_argument('-v', '--verbose', action='store_true')
 
 args = parser.parse_args()
 
 code = [int(s) for s in sys.stdin.read().split()]
 irc = IRConverter(leader_pulse=[8, 4], space_pulse=[1, 1], mark_pulse=[1, 3])
-frames = irc.decode_frames(code, args.periodic_time)
+T = args.periodic_time
+if T is None:
+    T, confidence = irc.estimate_periodic_time(code)
+    if args.verbose or confidence < 0.9:
+        print(f"Periodic Time: {T:.1f} (confidence {confidence:.2f})", file=sys.stderr)
+frames = irc.decode_frames(code, T)
+if not any(frames):
+    sys.exit(f"No frames decoded with periodic time {T:.1f}")
 
 for i, frame in enumerate(frames):
     if args.verbose:
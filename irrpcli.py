@@ -21,6 +21,15 @@ where
 -r record
 -g the GPIO connected to the IR receiver
 
+To record continuously use
+
+./irrpcli.py -c -g4
+
+where
+
+-c print every recognised code on its own line until interrupted,
+   expecting only post milliseconds of silence before each code
+
 To playback use
 
 cat pulse | ./irrp.py -p -g17
@@ -33,6 +42,7 @@ where
 OPTIONS
 
 -r record
+-c record continuously
 -p playback
 -g GPIO (receiver for record, transmitter for playback)
 
@@ -44,6 +54,7 @@ RECORD
 --short      reject codes with less than short pulses, default 10
 --tolerance  consider pulses the same if within tolerance percent, default 15
 --no-confirm don't require a code to be repeated during record
+--buffer     number of edges buffered for the reader, default 65536
 
 TRANSMIT
 
@@ -54,16 +65,23 @@ TRANSMIT
 import os
 import sys
 import time
+import array
 import argparse
 
 import pigpio # http://abyz.co.uk/rpi/pigpio/python.html
 from lib.ir_client import IRClient
 
+try:
+   import numpy as np
+except ImportError:
+   np = None
+
 p = argparse.ArgumentParser()
 
 g = p.add_mutually_exclusive_group(required=True)
 g.add_argument("-p", "--play",   help="play keys",   action="store_true")
 g.add_argument("-r", "--record", help="record keys", action="store_true")
+g.add_argument("-c", "--continuous", help="record keys continuously", action="store_true")
 
 p.add_argument("-g", "--gpio", help="GPIO for RX/TX", required=True, type=int)
 
@@ -75,12 +93,16 @@ p.add_argument("--post",      help="postamble ms",      type=int, default=15)
 p.add_argument("--pre",       help="preamble ms",       type=int, default=200)
 p.add_argument("--short",     help="short code length", type=int, default=10)
 p.add_argument("--tolerance", help="tolerance percent", type=int, default=15)
+p.add_argument("--buffer",    help="edge buffer size",  type=int, default=65536)
 
 p.add_argument("-v", "--verbose", help="Be verbose",     action="store_true")
 p.add_argument("--no-confirm", help="No confirm needed", action="store_true")
 
 args = p.parse_args()
 
+if args.buffer <= 0:
+   p.error("--buffer must be positive")
+
 GPIO       = args.gpio
 GLITCH     = args.glitch
 PRE_MS     = args.pre
@@ -91,18 +113,26 @@ SHORT      = args.short
 GAP_MS     = args.gap
 NO_CONFIRM = args.no_confirm
 TOLERANCE  = args.tolerance
+BUFFER     = args.buffer
 
 POST_US    = POST_MS * 1000
 PRE_US     = PRE_MS  * 1000
-GAP_S      = GAP_MS  / 1000.0
 CONFIRM    = not NO_CONFIRM
 TOLER_MIN =  (100 - TOLERANCE) / 100.0
 TOLER_MAX =  (100 + TOLERANCE) / 100.0
 
+# below this many pulses the pure tidy_mark_space is faster
+NUMPY_MIN  = 500
+
 last_tick = 0
-in_code = False
-code = []
-fetching_code = False
+
+# Edges are passed from the pigpio callback thread to the main thread
+# through a preallocated ring buffer.  The callback is the only writer
+# of edge_head and the reader the only writer of edge_tail, so no lock
+# is needed.  A zero entry marks a watchdog timeout.
+edges = array.array('L', [0] * BUFFER)
+edge_head = 0
+edge_tail = 0
 
 def normalise(c):
    """
@@ -203,6 +233,10 @@ def compare(p1, p2):
 
 def tidy_mark_space(record, base):
 
+   if np is not None and len(record) >= NUMPY_MIN:
+      tidy_mark_space_numpy(record, base)
+      return
+
    ms = {}
 
    # Find all the unique marks (base=0) or spaces (base=1)
@@ -262,49 +296,148 @@ def tidy_mark_space(record, base):
    for i in range(base, len(record), 2):
       record[i] = ms[record[i]]
 
+def tidy_mark_space_numpy(record, base):
+   """
+   tidy_mark_space using sorted NumPy arrays.  The clusters and
+   their averages are the same as tidy_mark_space gives.
+   """
+   try:
+      values = np.frombuffer(array.array("q", record[base::2]), np.int64)
+   except (TypeError, OverflowError): # not all integers
+      values = np.array(record[base::2])
+   if len(values) and values.dtype.kind == "i" and values.min() >= 0 and values.max() < (1 << 20):
+      # microsecond lengths are counted faster than sorted
+      counts = np.bincount(values)
+      plens = np.flatnonzero(counts)
+      counts = counts[plens]
+      position = np.zeros(plens[-1] + 1, int)
+      position[plens] = np.arange(len(plens))
+      index = position[values]
+   else:
+      plens, index, counts = np.unique(values, return_inverse=True, return_counts=True)
+
+   if VERBOSE:
+      print("t_m_s A", dict(zip(plens.tolist(), counts.tolist())))
+
+   # Each cluster holds the lengths below TOLER_MAX times its shortest.
+   ends = np.searchsorted(plens, plens * TOLER_MAX, 'left').tolist()
+   starts = []
+   start = 0
+   while start < len(plens):
+      starts.append(start)
+      start = max(ends[start], start + 1)
+
+   tots = plens * counts
+   if tots.dtype.kind == "f":
+      # added in order like tidy_mark_space, as pairwise sums may round differently
+      tots = tots.astype(object)
+   tots = np.add.reduceat(tots, starts).astype(float)
+   similar = np.add.reduceat(counts, starts)
+   averages = np.repeat(np.round(tots / similar), np.diff(starts + [len(plens)])).astype(int)
+
+   if VERBOSE:
+      print("t_m_s B", dict(zip(plens.tolist(), averages.tolist())))
+
+   record[base::2] = averages[index].tolist()
+
 def tidy(record):
 
    tidy_mark_space(record, 0) # Marks.
 
    tidy_mark_space(record, 1) # Spaces.
 
-def end_of_code():
-   global code, fetching_code
-   if len(code) > SHORT:
-      normalise(code)
-      fetching_code = False
-   else:
-      code = []
-      print("Short code, probably a repeat, try again")
-
 def cbf(gpio, level, tick):
 
-   global last_tick, in_code, code, fetching_code
+   global last_tick, edge_head
 
    if level != pigpio.TIMEOUT:
-
-      edge = pigpio.tickDiff(last_tick, tick)
+      edges[edge_head % BUFFER] = pigpio.tickDiff(last_tick, tick)
       last_tick = tick
+   else:
+      edges[edge_head % BUFFER] = 0
 
-      if fetching_code:
-
-         if (edge > PRE_US) and (not in_code): # Start of a code.
-            in_code = True
-            pi.set_watchdog(GPIO, POST_MS) # Start watchdog.
+   edge_head += 1
 
-         elif (edge > POST_US) and in_code: # End of a code.
-            in_code = False
-            pi.set_watchdog(GPIO, 0) # Cancel watchdog.
-            end_of_code()
+def next_edge():
+   """
+   Wait for the next buffered edge.  Returns 0 on watchdog timeout
+   and None when edges were lost.
+   """
+   global edge_tail
 
-         elif in_code:
-            code.append(edge)
+   while edge_tail == edge_head:
+      time.sleep(0.01)
 
+   if edge_head - edge_tail > BUFFER:
+      sys.stderr.write('Edge buffer overrun, increase --buffer\n')
+      sys.stderr.flush()
+      edge_tail = edge_head - BUFFER
+      edge = None
    else:
-      pi.set_watchdog(GPIO, 0) # Cancel watchdog.
-      if in_code:
+      edge = edges[edge_tail % BUFFER]
+
+   edge_tail += 1
+   return edge
+
+def discard_edges():
+   global edge_tail
+   edge_tail = edge_head
+
+def captured_codes(pre_us):
+   """
+   Yield every normalised code longer than SHORT pulses.
+
+   A code starts after more than pre_us of silence and ends after
+   POST_US of silence.  A silence long enough to do both ends one
+   code and starts the next, so with pre_us of POST_US keys pressed
+   in quick succession are not lost.  Edges outside a code are
+   reported on stderr.
+   """
+   in_code = False
+   code = []
+   reported = False
+
+   while True:
+      edge = next_edge()
+
+      if edge is None: # Edges lost.
+         if in_code:
+            sys.stderr.write('Partial code dropped\n')
+            sys.stderr.flush()
          in_code = False
-         end_of_code()
+         pi.set_watchdog(GPIO, 0) # Cancel watchdog.
+         code = []
+         continue
+
+      if in_code and (edge == 0 or edge > POST_US): # End of a code.
+         in_code = False
+         pi.set_watchdog(GPIO, 0) # Cancel watchdog.
+         if len(code) > SHORT:
+            normalise(code)
+            yield code
+         else:
+            sys.stderr.write('Short code, probably a repeat, try again\n')
+            sys.stderr.flush()
+         code = []
+
+      if edge == 0:
+         pi.set_watchdog(GPIO, 0) # Cancel watchdog.
+
+      elif (edge > pre_us) and (not in_code): # Start of a code.
+         in_code = True
+         reported = False
+         pi.set_watchdog(GPIO, POST_MS) # Start watchdog.
+
+      elif in_code:
+         code.append(edge)
+
+      elif edge > POST_US: # Silence between ignored edges.
+         reported = False
+
+      elif not reported:
+         sys.stderr.write('Code without preamble ignored\n')
+         sys.stderr.flush()
+         reported = True
 
 pi = pigpio.pi() # Connect to Pi.
 
@@ -321,13 +454,12 @@ if args.record: # Record.
 
    cb = pi.callback(GPIO, pigpio.EITHER_EDGE, cbf)
 
+   codes = captured_codes(PRE_US)
+
    sys.stderr.write('Recording\n')
    sys.stderr.write('Press key for record\n')
    sys.stderr.flush()
-   code = [] # global
-   fetching_code = True
-   while fetching_code:
-      time.sleep(0.1)
+   code = next(codes)
    sys.stderr.write('Okay\n')
    time.sleep(0.5)
 
@@ -338,11 +470,8 @@ if args.record: # Record.
       tries = 0
       while not done:
          sys.stderr.write('Press key to confirm\n')
-         code = []
-         fetching_code = True
-         while fetching_code:
-            time.sleep(0.1)
-         press_2 = code[:]
+         discard_edges()
+         press_2 = next(codes)
          the_same = compare(press_1, press_2)
          if the_same:
             done = True
@@ -360,6 +489,7 @@ if args.record: # Record.
    else: # No confirm.
       record = code[:]
 
+   cb.cancel()
    pi.set_glitch_filter(GPIO, 0) # Cancel glitch filter.
    pi.set_watchdog(GPIO, 0) # Cancel watchdog.
 
@@ -367,25 +497,35 @@ if args.record: # Record.
 
    print(*record, sep=' ')
 
-else: # Playback.
+elif args.continuous: # Continuous record.
 
-   codes = [[int(s) for s in l.split()] for l in sys.stdin.read().splitlines()]
+   pi.set_mode(GPIO, pigpio.INPUT) # IR RX connected to this GPIO.
 
-   if VERBOSE:
-      print("Playing")
+   pi.set_glitch_filter(GPIO, GLITCH) # Ignore glitches.
 
-   emit_time = time.time()
+   cb = pi.callback(GPIO, pigpio.EITHER_EDGE, cbf)
 
-   for code in codes:
-      emit_time = time.time()
+   sys.stderr.write('Recording, press Ctrl-C to stop\n')
+   sys.stderr.flush()
 
-      IRClient.send(code, GPIO, FREQ)
+   try:
+      for code in captured_codes(POST_US):
+         tidy(code)
+         print(*code, sep=' ', flush=True)
+   except KeyboardInterrupt:
+      pass
 
-      delay = emit_time - time.time()
+   cb.cancel()
+   pi.set_glitch_filter(GPIO, 0) # Cancel glitch filter.
+   pi.set_watchdog(GPIO, 0) # Cancel watchdog.
+
+else: # Playback.
 
-      if delay > 0.0:
-         time.sleep(delay)
+   codes = ([int(s) for s in l.split()] for l in sys.stdin if l.strip())
+
+   if VERBOSE:
+      print("Playing")
 
-      emit_time = time.time() + GAP_S
+   IRClient.send_sequence(codes, GPIO, FREQ, GAP_MS * 1000)
 
 pi.stop() # Disconnect from Pi.
@@ -1,13 +1,34 @@
 import time
+import asyncio
 import collections
 import pigpio
+try:
+    import numpy as np
+except ImportError:
+    np = None
+from . import profiler
+from . import pigpiod
 
 class IRClient:
+    MAX_ENTRY = 600
+    MAX_LOOP = 20
+    MAX_SEGMENT = 2000
+    # waves and DMA control blocks a batch of chains may use; pigpiod
+    # has 250 waves and about 25000 control blocks, and wave indices
+    # in a chain must stay below the 255 command byte
+    MAX_WAVES = 250
+    MAX_CBS = 20000
+    # percentage of wave resources each streamed segment is padded to
+    SEGMENT_PAD = 50
+
     @classmethod
     def carrier(cls, gpio, frequency, micros):
         """
         Generate carrier square wave.
         """
+        if np is not None:
+            return cls.carrier_numpy(gpio, frequency, micros)
+
         wf = []
         cycle = 1000.0 / frequency
         cycles = int(round(micros / cycle))
@@ -23,7 +44,103 @@ class IRClient:
         return wf
 
     @classmethod
-    def send(cls, code, pin, freq):
+    def carrier_numpy(cls, gpio, frequency, micros):
+        """
+        carrier computing the cycle lengths with NumPy.  The pulses
+        are the same as the loop in carrier gives.
+        """
+        cycle = 1000.0 / frequency
+        cycles = int(round(micros / cycle))
+        on = int(round(cycle / 2.0))
+
+        # each cycle ends at round((c + 1) * cycle)
+        targets = np.round(np.arange(1, cycles + 1) * cycle).astype(np.int64)
+        offs = targets.copy()
+        offs[1:] -= targets[:-1]
+        offs -= on
+
+        # pulses are only read, so equal ones can be shared
+        on_pulse = pigpio.pulse(1 << gpio, 0, on)
+        off_pulses = {off: pigpio.pulse(0, 1 << gpio, off) for off in np.unique(offs).tolist()}
+        wf = [on_pulse] * (2 * cycles)
+        wf[1::2] = [off_pulses[off] for off in offs.tolist()]
+        return wf
+
+    @classmethod
+    def delay(cls, micros):
+        """
+        Generate wave chain delay entries.
+        """
+        entries = []
+        while micros > 0:
+            d = min(micros, 0xffff)
+            entries += [255, 2, d & 0xff, d >> 8]
+            micros -= d
+        return entries
+
+    @classmethod
+    def chain_loops(cls, chain):
+        """
+        Count loops in a wave chain.
+        """
+        loops = 0
+        i = 0
+        while i < len(chain):
+            if chain[i] != 255:
+                i += 1
+                continue
+            if chain[i+1] == 0:
+                loops += 1
+            i += 4 if chain[i+1] in (1, 2) else 2
+        return loops
+
+    @classmethod
+    def map_chain(cls, chain, wids):
+        """
+        Replace the wave indices in a chain with wave ids.
+        """
+        chain = chain[:]
+        i = 0
+        while i < len(chain):
+            if chain[i] != 255:
+                chain[i] = wids[chain[i]]
+                i += 1
+                continue
+            i += 4 if chain[i+1] in (1, 2) else 2
+        return chain
+
+    @classmethod
+    def pattern(cls, code, waves):
+        """
+        Return code as indices into waves, adding the marks and
+        spaces missing from it.  waves maps (is_space, length) to
+        an index.
+        """
+        wave = [0] * len(code)
+
+        for i in range(0, len(code)):
+            key = (i & 1, code[i])
+            if key not in waves:
+                waves[key] = len(waves)
+            wave[i] = waves[key]
+
+        return wave
+
+    @classmethod
+    def wave_cbs(cls, waves, freq):
+        """
+        Estimate the DMA control blocks needed by the marks and
+        spaces of waves.  Each pulse takes one for the level change
+        and one for the delay, and each wave one more.
+        """
+        cycle = 1000.0 / freq
+        cbs = 0
+        for space, length in waves:
+            cbs += 2 if space else 4 * int(round(length / cycle)) + 1
+        return cbs
+
+    @classmethod
+    def connect(cls, pin):
         pi = pigpio.pi() # Connect to Pi.
 
         if not pi.connected:
@@ -32,47 +149,205 @@ class IRClient:
         try:
             pi.set_mode(pin, pigpio.OUTPUT) # IR TX connected to this GPIO.
             pi.wave_add_new()
+        except Exception:
+            pi.stop()
+            raise
+
+        return pi
+
+    @classmethod
+    def create_waves(cls, pi, waves, pin, freq):
+        """
+        Create the marks and spaces of waves.  Returns their wave
+        ids by index.
+        """
+        wids = [0] * len(waves)
+        for (space, length), index in waves.items():
+            if space:
+                pi.wave_add_generic([pigpio.pulse(0, 0, length)])
+            else:
+                pi.wave_add_generic(cls.carrier(pin, freq, length))
+            wids[index] = pi.wave_create()
+        return wids
 
-            marks_wid = {}
-            spaces_wid = {}
+    @classmethod
+    def delete_waves(cls, pi, wids):
+        for wid in wids:
+            pi.wave_delete(wid)
 
-            wave = [0] * len(code)
+    @classmethod
+    def send(cls, code, pin, freq):
+        cls.send_sequence([code], pin, freq)
 
-            for i in range(0, len(code)):
-                ci = code[i]
-                if i & 1: # Space
-                    if ci not in spaces_wid:
-                        pi.wave_add_generic([pigpio.pulse(0, 0, ci)])
-                        spaces_wid[ci] = pi.wave_create()
-                    wave[i] = spaces_wid[ci]
-                else: # Mark
-                    if ci not in marks_wid:
-                        wf = cls.carrier(pin, freq, ci)
-                        pi.wave_add_generic(wf)
-                        marks_wid[ci] = pi.wave_create()
-                    wave[i] = marks_wid[ci]
+    @classmethod
+    def send_sequence(cls, codes, pin, freq, gap=0):
+        """
+        Send codes one after another, gap microseconds apart.
 
-            wave = cls.compress_wave(wave)
-            pi.wave_chain(wave)
+        The waves of a batch of codes are created before its first
+        code is sent, and as many codes and gaps as fit are put into
+        a single wave chain, so the gaps are timed by the hardware.
+        Codes too long for a chain of their own are streamed in
+        segments instead.
+        """
+        plan = cls.plan(codes, gap, freq)
 
-            while pi.wave_tx_busy():
-                time.sleep(0.002)
+        pi = cls.connect(pin)
 
-            for i in marks_wid:
-                pi.wave_delete(marks_wid[i])
+        try:
+            wids = None
+            for item in plan:
+                if isinstance(item, dict):
+                    with profiler.phase('wave'):
+                        if wids is not None:
+                            cls.delete_waves(pi, wids)
+                            wids = None
+                        wids = cls.create_waves(pi, item, pin, freq)
+                    continue
+
+                if isinstance(item, tuple):
+                    # the segments need all wave resources
+                    if wids is not None:
+                        cls.delete_waves(pi, wids)
+                        wids = None
+                    with profiler.phase('transmit'):
+                        cls.stream(pi, item[0], pin, freq, item[1])
+                    continue
+
+                with profiler.phase('transmit'):
+                    pi.wave_chain(cls.map_chain(item, wids))
 
-            for i in spaces_wid:
-                pi.wave_delete(spaces_wid[i])
+                    while pi.wave_tx_busy():
+                        time.sleep(0.002)
+
+            if wids is not None:
+                cls.delete_waves(pi, wids)
 
         finally:
             pi.stop() # Disconnect from Pi.
 
     @classmethod
-    def compress_wave(cls, code):
-        MAX_ENTRY = 600
-        MAX_LOOP = 20
+    def plan(cls, codes, gap, freq):
+        """
+        Arrange codes into batches of wave chains.  Each batch starts
+        with the waves its chains use, as given by pattern, which
+        replace those of the previous batch.  A batch stays within
+        MAX_WAVES and MAX_CBS.  Codes too long for a chain, or whose
+        waves do not fit a batch, become (code, lead) tuples to be
+        streamed after lead microseconds; no waves exist while they
+        are sent.
+        """
+        plan = []
+        waves = None
+        cbs = 0
+        chain = []
+        loops = 0
+
+        for code in codes:
+            lead = gap if plan else 0
+            code_waves = dict(waves or {})
+            wave = cls.pattern(code, code_waves)
+            added = [key for key in code_waves if waves is None or key not in waves]
+            added_cbs = cls.wave_cbs(added, freq)
+            batch = waves is None or len(code_waves) > cls.MAX_WAVES or cbs + added_cbs > cls.MAX_CBS
+            if batch and waves is not None:
+                code_waves = {}
+                wave = cls.pattern(code, code_waves)
+                added_cbs = cls.wave_cbs(code_waves, freq)
+            with profiler.phase('compress'):
+                wave = cls.compress_wave(wave)
+            wave_loops = cls.chain_loops(wave)
+            if len(wave) > cls.MAX_ENTRY or wave_loops > cls.MAX_LOOP or len(code_waves) > cls.MAX_WAVES or added_cbs > cls.MAX_CBS:
+                if chain:
+                    plan.append(chain)
+                    chain = []
+                    loops = 0
+                plan.append((code, lead))
+                waves = None
+                continue
+            if batch:
+                if chain:
+                    plan.append(chain)
+                    chain = []
+                    loops = 0
+                waves = code_waves
+                cbs = 0
+                plan.append(waves)
+            else:
+                waves.update(code_waves)
+            cbs += added_cbs
+            wave = cls.delay(lead) + wave
+            if chain and (len(chain) + len(wave) > cls.MAX_ENTRY or loops + wave_loops > cls.MAX_LOOP):
+                plan.append(chain)
+                chain = []
+                loops = 0
+            chain += wave
+            loops += wave_loops
+
+        if chain:
+            plan.append(chain)
+
+        return plan
+
+    @classmethod
+    def segments(cls, code, pin, freq, lead=0):
+        """
+        Split code into pulse lists of about MAX_SEGMENT pulses,
+        each starting with a mark.  lead microseconds of silence
+        are put before the first one.
+        """
+        wf = [pigpio.pulse(0, 0, lead)] if lead > 0 else []
+        for i in range(0, len(code)):
+            if i & 1: # Space
+                wf.append(pigpio.pulse(0, 0, code[i]))
+                if len(wf) >= cls.MAX_SEGMENT:
+                    yield wf
+                    wf = []
+            else: # Mark
+                wf += cls.carrier(pin, freq, code[i])
+        if wf:
+            yield wf
+
+    @classmethod
+    def stream(cls, pi, code, pin, freq, lead=0):
+        """
+        Send a code of any length as a series of waves.
+
+        Each segment is queued to start as soon as the previous one
+        ends, and the next segment is built while it transmits.  The
+        segments are padded to SEGMENT_PAD percent of the wave
+        resources, so each one reuses the resources of the segment
+        before the previous one; no other waves may exist meanwhile.
+        Raises RuntimeError if a segment is not ready before the
+        previous one ends, as the code would then have a gap.
+        """
+        previous = None
+        for wf in cls.segments(code, pin, freq, lead):
+            pi.wave_add_generic(wf)
+            wid = pi.wave_create_and_pad(cls.SEGMENT_PAD)
+            if previous is not None and pi.wave_tx_at() == pigpio.NO_TX_WAVE:
+                pi.wave_delete(wid)
+                pi.wave_delete(previous)
+                raise RuntimeError('segment not ready before the previous one ended')
+            pi.wave_send_using_mode(wid, pigpio.WAVE_MODE_ONE_SHOT_SYNC)
 
-        if len(code) < MAX_ENTRY:
+            # wait until the previous segment has finished
+            while pi.wave_tx_at() not in (wid, pigpio.NO_TX_WAVE):
+                time.sleep(0.001)
+
+            if previous is not None:
+                pi.wave_delete(previous)
+            previous = wid
+
+        while pi.wave_tx_busy():
+            time.sleep(0.002)
+
+        if previous is not None:
+            pi.wave_delete(previous)
+
+    @classmethod
+    def compress_wave(cls, code):
+        if len(code) < cls.MAX_ENTRY:
             return code
 
         def ngram(l, n):
@@ -110,7 +385,7 @@ class IRClient:
         # excluding overlaps
         cands = [0]
         for i in range(1, len(blocks)):
-            if len(cands) >= MAX_LOOP:
+            if len(cands) >= cls.MAX_LOOP:
                 break
             astart, asize, acount = blocks[i]
             aend = astart + asize * acount - 1
@@ -131,3 +406,127 @@ class IRClient:
             code[start:start+size*count] = [255, 0] + code[start:start+size] + [255, 1, mod, div]
 
         return code
+
+class PipelinedIRClient(IRClient):
+    """
+    IRClient talking to pigpiod directly.  Every wave of a sequence
+    is created in one round trip, and so are the deletions.
+    """
+    @classmethod
+    def connect(cls, pin):
+        pi = pigpiod.Pigpiod()
+        # sent along with the next commands
+        pi.queue(pigpiod.MODES, pin, pigpio.OUTPUT) # IR TX connected to this GPIO.
+        pi.queue(pigpiod.WVNEW)
+        return pi
+
+    @classmethod
+    def queue_waves(cls, pi, waves, pin, freq):
+        """
+        Queue creation of the marks and spaces of waves.  Returns
+        the reply indices of their wave ids by index.
+        """
+        replies = [0] * len(waves)
+        for (space, length), index in waves.items():
+            if space:
+                pi.queue(pigpiod.WVAG, ext=pigpiod.pulses([pigpio.pulse(0, 0, length)]))
+            else:
+                pi.queue(pigpiod.WVAG, ext=pigpiod.pulses(cls.carrier(pin, freq, length)))
+            replies[index] = pi.queue(pigpiod.WVCRE)
+        return replies
+
+    @classmethod
+    def create_waves(cls, pi, waves, pin, freq):
+        replies = cls.queue_waves(pi, waves, pin, freq)
+        results = pi.flush()
+        return [results[i] for i in replies]
+
+    @classmethod
+    def delete_waves(cls, pi, wids):
+        for wid in wids:
+            pi.queue(pigpiod.WVDEL, wid)
+        pi.flush()
+
+    @classmethod
+    async def send_sequence_async(cls, codes, pin, freq, gap=0):
+        """
+        send_sequence for asyncio servers.  Waits for transmission
+        without blocking the event loop.
+        """
+        plan = cls.plan(codes, gap, freq)
+
+        pi = await pigpiod.AsyncPigpiod.connect()
+
+        try:
+            pi.queue(pigpiod.MODES, pin, pigpio.OUTPUT) # IR TX connected to this GPIO.
+            pi.queue(pigpiod.WVNEW)
+
+            wids = None
+            for item in plan:
+                if isinstance(item, dict):
+                    with profiler.phase('wave'):
+                        if wids is not None:
+                            for wid in wids:
+                                pi.queue(pigpiod.WVDEL, wid)
+                        replies = cls.queue_waves(pi, item, pin, freq)
+                        results = await pi.flush()
+                        wids = [results[i] for i in replies]
+                    continue
+
+                if isinstance(item, tuple):
+                    # the segments need all wave resources
+                    if wids is not None:
+                        for wid in wids:
+                            pi.queue(pigpiod.WVDEL, wid)
+                        wids = None
+                    with profiler.phase('transmit'):
+                        await cls.stream_async(pi, item[0], pin, freq, item[1])
+                    continue
+
+                with profiler.phase('transmit'):
+                    await pi.call(pigpiod.WVCHA, ext=bytes(cls.map_chain(item, wids)))
+
+                    while await pi.call(pigpiod.WVBSY):
+                        await asyncio.sleep(0.002)
+
+            if wids is not None:
+                for wid in wids:
+                    pi.queue(pigpiod.WVDEL, wid)
+            await pi.flush()
+
+        finally:
+            pi.stop() # Disconnect from Pi.
+
+    @classmethod
+    async def stream_async(cls, pi, code, pin, freq, lead=0):
+        """
+        stream for asyncio servers.
+        """
+        previous = None
+        for wf in cls.segments(code, pin, freq, lead):
+            pi.queue(pigpiod.WVAG, ext=pigpiod.pulses(wf))
+            i = pi.queue(pigpiod.WVCAP, cls.SEGMENT_PAD)
+            if previous is not None:
+                pi.queue(pigpiod.WVTAT)
+            results = await pi.flush()
+            wid = results[i]
+            if previous is not None and results[-1] == pigpio.NO_TX_WAVE:
+                pi.queue(pigpiod.WVDEL, wid)
+                pi.queue(pigpiod.WVDEL, previous)
+                await pi.flush()
+                raise RuntimeError('segment not ready before the previous one ended')
+            await pi.call(pigpiod.WVTXM, wid, pigpio.WAVE_MODE_ONE_SHOT_SYNC)
+
+            # wait until the previous segment has finished
+            while await pi.call(pigpiod.WVTAT) not in (wid, pigpio.NO_TX_WAVE):
+                await asyncio.sleep(0.001)
+
+            if previous is not None:
+                await pi.call(pigpiod.WVDEL, previous)
+            previous = wid
+
+        while await pi.call(pigpiod.WVBSY):
+            await asyncio.sleep(0.002)
+
+        if previous is not None:
+            await pi.call(pigpiod.WVDEL, previous)
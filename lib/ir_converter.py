@@ -1,6 +1,12 @@
+from collections import Counter
 from .utils import flatten
 
 class IRConverter:
+    # width of the histogram bins in microseconds
+    BIN_WIDTH = 20
+    # pulses longer than this many periods are gaps, not symbols
+    MAX_PERIODS = 16
+
     def __init__(self, leader_pulse, space_pulse, mark_pulse):
         self._leader_pulse = leader_pulse
         self._space_pulse = space_pulse
@@ -21,7 +27,69 @@ class IRConverter:
     def pulse(self, bit, T):
         return [T * t for t in (self.mark_pulse if bit else self.space_pulse)]
 
-    def decode_frames(self, pulses, T):
+    def estimate_periodic_time(self, pulses):
+        """
+        Estimate the periodic time T of a capture.
+
+        Receivers lengthen marks and shorten spaces by about the
+        same amount, so each mark is added to the space after it.
+        These pairs are binned in one pass, and the mean of the
+        shortest cluster holding at least 5% of them is taken as
+        the shortest symbol.  T is then refined to fit every pair
+        that is a leader or a bit.  Returns (T, confidence),
+        confidence being the share of pairs other than gaps that
+        decode as a leader or a bit with T.
+        """
+        pairs = [(pulses[i], pulses[i + 1]) for i in range(0, len(pulses) - 1, 2)]
+        if len(pairs) == 0:
+            raise ValueError('no pulses')
+
+        counts = Counter()
+        sums = Counter()
+        for mark, space in pairs:
+            b = int((mark + space) // self.BIN_WIDTH)
+            counts[b] += 1
+            sums[b] += mark + space
+
+        # bins separated by at most one empty bin are one cluster
+        threshold = 0.05 * len(pairs)
+        n, total = 0, 0
+        last = None
+        for b in sorted(counts):
+            if last is None or b > last + 2:
+                if last is not None and n >= threshold:
+                    break
+                n, total = 0, 0
+            n += counts[b]
+            total += sums[b]
+            last = b
+        base = total / n / min(sum(self.space_pulse), sum(self.mark_pulse))
+
+        symbols = (self.leader_pulse, self.space_pulse, self.mark_pulse)
+        lengths = set(sum(symbol) for symbol in symbols)
+        n, total = 0, 0
+        for mark, space in pairs:
+            periods = int((mark + space) / base + 0.5)
+            if periods in lengths:
+                n += periods
+                total += mark + space
+        T = total / n if n else base
+
+        count = 0
+        matched = 0
+        for mark, space in pairs:
+            if space / T > self.MAX_PERIODS:
+                continue
+            count += 1
+            if [int(mark / T + 0.5), int(space / T + 0.5)] in symbols:
+                matched += 1
+        confidence = matched / count if count else 0.0
+
+        return (T, confidence)
+
+    def decode_frames(self, pulses, T=None):
+        if T is None:
+            T, _ = self.estimate_periodic_time(pulses)
         periods = [int(float(t) / T + 0.5) for t in pulses]
         data = []
         i = 0
@@ -0,0 +1,160 @@
+import os
+import socket
+import struct
+import asyncio
+
+# pigpiod socket command numbers
+MODES = 0
+WVAG = 28
+WVBSY = 32
+WVCRE = 49
+WVDEL = 50
+WVNEW = 53
+WVCHA = 93
+WVTXM = 100
+WVTAT = 101
+WVCAP = 118
+
+_CMD = struct.Struct('<IIII')
+_RES = struct.Struct('<IIIi')
+_PULSE = struct.Struct('<III')
+
+class PigpiodError(RuntimeError):
+    pass
+
+def address(host=None, port=None):
+    """
+    Default to the daemon the pigpio library would connect to.
+    """
+    host = host or os.getenv('PIGPIO_ADDR', 'localhost')
+    port = port or int(os.getenv('PIGPIO_PORT', 8888))
+    return (host, port)
+
+def pulses(wf):
+    """
+    Encode pigpio pulses as a WVAG extension.
+    """
+    return b''.join(_PULSE.pack(p.gpio_on, p.gpio_off, p.delay) for p in wf)
+
+class Pipeline:
+    """
+    Queue of pigpiod commands sent together.
+
+    pigpiod runs the commands of a connection in order, so commands
+    which do not need an earlier reply can be queued and sent in one
+    write, then all replies read at once.
+    """
+    def __init__(self):
+        self.pending = []
+
+    def queue(self, cmd, p1=0, p2=0, ext=b''):
+        """
+        Queue a command.  Returns the index of its reply in the
+        list returned by the next flush.
+        """
+        self.pending.append(_CMD.pack(cmd, p1, p2, len(ext)) + ext)
+        return len(self.pending) - 1
+
+    def take(self):
+        data = b''.join(self.pending)
+        count = len(self.pending)
+        self.pending = []
+        return (data, count)
+
+    @classmethod
+    def results(cls, data, count):
+        results = [_RES.unpack_from(data, i * _RES.size)[3] for i in range(count)]
+        for res in results:
+            if res < 0:
+                raise PigpiodError('pigpiod error {0}'.format(res))
+        return results
+
+class Pigpiod(Pipeline):
+    """
+    Blocking pigpiod client.  Besides queue and flush, it provides
+    the subset of pigpio.pi used by IRClient, each being one round
+    trip.
+    """
+    def __init__(self, host=None, port=None):
+        super().__init__()
+        self.sock = socket.create_connection(address(host, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connected = True
+
+    def flush(self):
+        data, count = self.take()
+        if count == 0:
+            return []
+        self.sock.sendall(data)
+        buf = bytearray(count * _RES.size)
+        view = memoryview(buf)
+        received = 0
+        while received < len(buf):
+            n = self.sock.recv_into(view[received:])
+            if n == 0:
+                raise PigpiodError('connection closed by pigpiod')
+            received += n
+        return self.results(buf, count)
+
+    def call(self, cmd, p1=0, p2=0, ext=b''):
+        self.queue(cmd, p1, p2, ext)
+        return self.flush()[-1]
+
+    def set_mode(self, gpio, mode):
+        return self.call(MODES, gpio, mode)
+
+    def wave_add_new(self):
+        return self.call(WVNEW)
+
+    def wave_add_generic(self, wf):
+        return self.call(WVAG, ext=pulses(wf))
+
+    def wave_create(self):
+        return self.call(WVCRE)
+
+    def wave_create_and_pad(self, percent):
+        return self.call(WVCAP, percent)
+
+    def wave_delete(self, wave_id):
+        return self.call(WVDEL, wave_id)
+
+    def wave_chain(self, data):
+        return self.call(WVCHA, ext=bytes(data))
+
+    def wave_send_using_mode(self, wave_id, mode):
+        return self.call(WVTXM, wave_id, mode)
+
+    def wave_tx_at(self):
+        return self.call(WVTAT)
+
+    def wave_tx_busy(self):
+        return self.call(WVBSY)
+
+    def stop(self):
+        self.connected = False
+        self.sock.close()
+
+class AsyncPigpiod(Pipeline):
+    """
+    asyncio pigpiod client.  Use connect to create one.
+    """
+    @classmethod
+    async def connect(cls, host=None, port=None):
+        self = cls()
+        self.reader, self.writer = await asyncio.open_connection(*address(host, port))
+        return self
+
+    async def flush(self):
+        data, count = self.take()
+        if count == 0:
+            return []
+        self.writer.write(data)
+        await self.writer.drain()
+        return self.results(await self.reader.readexactly(count * _RES.size), count)
+
+    async def call(self, cmd, p1=0, p2=0, ext=b''):
+        self.queue(cmd, p1, p2, ext)
+        return (await self.flush())[-1]
+
+    def stop(self):
+        self.writer.close()
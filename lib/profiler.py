@@ -0,0 +1,107 @@
+import os
+import sys
+import time
+import threading
+import collections
+
+enabled = os.getenv('PROFILE', '') not in ('', '0')
+
+_local = threading.local()
+
+class _NullPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_null_phase = _NullPhase()
+
+class Phase:
+    def __init__(self, timing, name):
+        self.timing = timing
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        self.timing.phases[self.name] = self.timing.phases.get(self.name, 0.0) + elapsed
+        return False
+
+class Timing:
+    def __init__(self):
+        self.phases = collections.OrderedDict()
+
+    def __enter__(self):
+        _local.timing = self
+        return self
+
+    def __exit__(self, *exc):
+        _local.timing = None
+        return False
+
+    def header(self):
+        """
+        Format the phases as a Server-Timing header value.
+        """
+        return ', '.join('{0};dur={1:.3f}'.format(name, sec * 1000) for name, sec in self.phases.items())
+
+def phase(name):
+    """
+    Time a block as a phase of the current request.
+    Does nothing unless profiling is enabled.
+    """
+    if not enabled:
+        return _null_phase
+    timing = getattr(_local, 'timing', None)
+    if timing is None:
+        return _null_phase
+    return Phase(timing, name)
+
+class Sampler:
+    """
+    Sampling profiler collecting the stacks of all other threads
+    every interval seconds, in collapsed-stack format.
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, seconds):
+        if self.running:
+            raise RuntimeError('sampler already running')
+        self.stacks = collections.Counter()
+        self.thread = threading.Thread(target=self.run, args=(seconds,), daemon=True)
+        self.thread.start()
+
+    def run(self, seconds):
+        me = threading.get_ident()
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('{0}:{1}'.format(os.path.basename(code.co_filename), code.co_name))
+                    frame = frame.f_back
+                with self.lock:
+                    self.stacks[';'.join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def collapsed(self):
+        """
+        Return the samples as lines of "frame;frame;... count".
+        """
+        with self.lock:
+            return ''.join('{0} {1}\n'.format(stack, count) for stack, count in sorted(self.stacks.items()))
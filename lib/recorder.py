@@ -0,0 +1,181 @@
+import os
+import mmap
+import struct
+
+# Segment files start with a header holding the number of records
+# written so far, followed by fixed-width records of timestamp,
+# temperature, humidity and pressure.
+_HEADER = struct.Struct('<4sIQ')
+_RECORD = struct.Struct('<4d')
+MAGIC = b'MYRS'
+
+def segment_paths(directory):
+    """
+    Return (start time, path) of every segment, ordered by start
+    time.  Segments are named by the time of their first record,
+    with a -N suffix when that name is taken.
+    """
+    segments = []
+    for name in os.listdir(directory):
+        stem, ext = os.path.splitext(name)
+        first, _, n = stem.partition('-')
+        if ext == '.seg' and first.isdigit() and (n == '' or n.isdigit()):
+            segments.append((int(first), int(n or 0), os.path.join(directory, name)))
+    return [(first, path) for first, n, path in sorted(segments)]
+
+class Segment:
+    def __init__(self, path, capacity=None):
+        """
+        Map a segment file.  A new file is created with room for
+        capacity records when capacity is given.
+        """
+        writable = capacity is not None
+        if writable and not os.path.exists(path):
+            # built under another name, so readers never see it half made
+            tmp = path + '.tmp'
+            fd = os.open(tmp, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                os.ftruncate(fd, _HEADER.size + capacity * _RECORD.size)
+                os.pwrite(fd, _HEADER.pack(MAGIC, _RECORD.size, 0), 0)
+            finally:
+                os.close(fd)
+            os.rename(tmp, path)
+
+        fd = os.open(path, os.O_RDWR if writable else os.O_RDONLY)
+        try:
+            size = os.fstat(fd).st_size
+            self.map = mmap.mmap(fd, size, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+
+        magic, record_size, self.count = _HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or record_size != _RECORD.size:
+            self.map.close()
+            raise ValueError('not a segment file: {0}'.format(path))
+        self.capacity = (len(self.map) - _HEADER.size) // _RECORD.size
+
+        # records counted but not synced before a crash are zero
+        while self.count > 0 and self.record(self.count - 1)[0] == 0:
+            self.count -= 1
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+    @property
+    def last(self):
+        """
+        Timestamp of the last record, None when empty.
+        """
+        return self.record(self.count - 1)[0] if self.count else None
+
+    def record(self, i):
+        return _RECORD.unpack_from(self.map, _HEADER.size + i * _RECORD.size)
+
+    def append(self, timestamp, values):
+        _RECORD.pack_into(self.map, _HEADER.size + self.count * _RECORD.size, timestamp, *values)
+        self.count += 1
+        _HEADER.pack_into(self.map, 0, MAGIC, _RECORD.size, self.count)
+
+    def bisect(self, timestamp):
+        """
+        Return the index of the first record at or after timestamp.
+        """
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.record(mid)[0] < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        self.map.close()
+
+class Recorder:
+    """
+    Appends readings to rotating segment files in directory.
+    Segments are synced to disk every sync_every records.
+    """
+    def __init__(self, directory, segment_records=86400, sync_every=60):
+        self.directory = directory
+        self.segment_records = segment_records
+        self.sync_every = sync_every
+        self.unsynced = 0
+        self.segment = None
+
+        os.makedirs(directory, exist_ok=True)
+        segments = segment_paths(directory)
+        if segments:
+            try:
+                segment = Segment(segments[-1][1], segment_records)
+            except ValueError: # left unfinished by an older version
+                segment = None
+            if segment is not None and segment.full:
+                segment.close()
+            else:
+                self.segment = segment
+
+    def append(self, timestamp, values):
+        # Each segment must be in time order.  If the clock was set
+        # back, a new segment is started instead.
+        if self.segment is None or self.segment.full or (self.segment.count and timestamp < self.segment.last):
+            self.rotate(timestamp)
+        self.segment.append(timestamp, values)
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every:
+            self.sync()
+
+    def rotate(self, timestamp):
+        if self.segment is not None:
+            self.sync()
+            self.segment.close()
+        path = os.path.join(self.directory, '{0:d}.seg'.format(int(timestamp)))
+        n = 0
+        while os.path.exists(path):
+            n += 1
+            path = os.path.join(self.directory, '{0:d}-{1:d}.seg'.format(int(timestamp), n))
+        self.segment = Segment(path, self.segment_records)
+
+    def sync(self):
+        if self.segment is not None:
+            self.segment.flush()
+        self.unsynced = 0
+
+    def close(self):
+        if self.segment is not None:
+            self.sync()
+            self.segment.close()
+            self.segment = None
+
+def records(directory, start=None, end=None):
+    """
+    Yield (timestamp, temp, humidity, pressure) recorded in
+    [start, end), reading one segment at a time.  Records are in
+    time order unless the clock was set back while recording.
+    """
+    for first, path in segment_paths(directory):
+        if end is not None and first >= end:
+            break
+
+        try:
+            segment = Segment(path)
+        except ValueError: # left unfinished by an older version
+            continue
+        try:
+            if segment.count == 0 or (start is not None and segment.last < start):
+                continue
+            n = segment.bisect(start) if start is not None else 0
+            while n < segment.count:
+                record = segment.record(n)
+                if end is not None and record[0] >= end:
+                    break
+                if record[0] > 0: # not synced before a crash
+                    yield record
+                n += 1
+        finally:
+            segment.close()
@@ -1,6 +1,10 @@
 from smbus2 import SMBus
+from . import profiler
 
 class Sensor:
+    # standby time in ms for each t_sb setting
+    STANDBY_MS = [0.5, 62.5, 125, 250, 500, 1000, 10, 20]
+
     def __init__(self):
         self.bus_number = 1
         self.i2c_address = 0x76
@@ -130,6 +134,9 @@ class Sensor:
         self.write_reg(0xF4, ctrl_meas_reg)
         self.write_reg(0xF5, config_reg)
 
+        # the sensor measures once every standby_time seconds
+        self.standby_time = self.STANDBY_MS[t_sb] / 1000.0
+
     def read_data(self):
         data = []
         for i in range (0xF7, 0xF7 + 8):
@@ -141,5 +148,9 @@ class Sensor:
         return (temp_raw, hum_raw, pres_raw)
 
     def fetch(self):
-        t, h, p = self.compensate(self.read_data(), self.get_calib_param())
+        with profiler.phase('i2c'):
+            values = self.read_data()
+            dig = self.get_calib_param()
+        with profiler.phase('compensate'):
+            t, h, p = self.compensate(values, dig)
         return (t, h, p / 100)
@@ -0,0 +1,49 @@
+import time
+import threading
+
+class SingleFlight:
+    """
+    Shares one call of fn between concurrent callers, and reuses its
+    result for max_age seconds.
+    """
+    def __init__(self, fn, max_age=0):
+        self.fn = fn
+        self.max_age = max_age
+        self.cond = threading.Condition()
+        self.running = False
+        self.generation = 0
+        self.value = None
+        self.fetched = None
+
+    def __call__(self):
+        """
+        Return (value, fetched), fetched being the time.monotonic()
+        at which value was obtained.
+        """
+        with self.cond:
+            while True:
+                if self.fetched is not None and time.monotonic() - self.fetched < self.max_age:
+                    return (self.value, self.fetched)
+                if not self.running:
+                    break
+                generation = self.generation
+                self.cond.wait()
+                if self.generation != generation:
+                    return (self.value, self.fetched)
+            self.running = True
+
+        try:
+            value = self.fn()
+        except BaseException:
+            with self.cond:
+                self.running = False
+                self.cond.notify_all()
+            raise
+
+        with self.cond:
+            self.value = value
+            self.fetched = time.monotonic()
+            self.generation += 1
+            self.running = False
+            self.cond.notify_all()
+            return (self.value, self.fetched)
@@ -0,0 +1,78 @@
+import os
+import mmap
+import time
+import fcntl
+import struct
+from collections import namedtuple
+
+# sequence number, then timestamp, temperature, humidity and pressure.
+# The writer makes the sequence odd while it updates the values and even
+# again when it is done, so readers can detect and retry torn reads.
+_SEQ = struct.Struct('<Q')
+_DATA = struct.Struct('<4d')
+SIZE = _SEQ.size + _DATA.size
+
+Snapshot = namedtuple('Snapshot', ['seq', 'timestamp', 'temp', 'humidity', 'pressure'])
+
+class SnapshotWriter:
+    def __init__(self, path):
+        """
+        Open path for writing.  The seqlock allows a single writer,
+        so the file stays locked until close.
+        """
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(self.fd)
+            raise RuntimeError('snapshot {0} is written by another process'.format(path))
+        try:
+            os.ftruncate(self.fd, SIZE)
+            self.map = mmap.mmap(self.fd, SIZE)
+        except Exception:
+            os.close(self.fd)
+            raise
+        self.seq = _SEQ.unpack_from(self.map, 0)[0]
+        if self.seq & 1: # previous writer died while writing
+            self.seq += 1
+            _SEQ.pack_into(self.map, 0, self.seq)
+
+    def publish(self, values, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        _SEQ.pack_into(self.map, 0, self.seq + 1)
+        _DATA.pack_into(self.map, _SEQ.size, timestamp, *values)
+        self.seq += 2
+        _SEQ.pack_into(self.map, 0, self.seq)
+
+    def close(self):
+        self.map.close()
+        os.close(self.fd)
+
+class SnapshotReader:
+    def __init__(self, path):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            self.map = mmap.mmap(fd, SIZE, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+
+    def read(self, retries=100):
+        """
+        Return the latest Snapshot, or None if nothing has been
+        published yet.  seq counts the readings published so far.
+        """
+        for _ in range(retries):
+            seq = _SEQ.unpack_from(self.map, 0)[0]
+            if seq & 1:
+                time.sleep(0.001)
+                continue
+            data = _DATA.unpack_from(self.map, _SEQ.size)
+            if _SEQ.unpack_from(self.map, 0)[0] == seq:
+                if seq == 0:
+                    return None
+                return Snapshot(seq // 2, *data)
+        raise RuntimeError('snapshot is being updated too often')
+
+    def close(self):
+        self.map.close()
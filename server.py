@@ -1,32 +1,148 @@
 import os
 import json
-from bottle import get, put, run, request, response, error, HTTPResponse
+import time
+import threading
+import traceback
+from bottle import get, put, run, install, request, response, error, HTTPResponse
+from lib import profiler
 from lib.sensor import Sensor
-from lib.ir_client import IRClient
+from lib.snapshot import SnapshotWriter
+from lib.recorder import Recorder, records
+from lib.single_flight import SingleFlight
+from lib.ir_client import IRClient, PipelinedIRClient
 from lib.aircon import DaikinAircon
 
 IR_WRITE_PIN = os.getenv('IR_WRITE_PIN', 19)
+SENSOR_SNAPSHOT = os.getenv('SENSOR_SNAPSHOT')
+IR_PIPELINED = os.getenv('IR_PIPELINED', '') not in ('', '0')
+RECORD_DIR = os.getenv('RECORD_DIR')
 
 sensor = Sensor()
+SENSOR_MAX_AGE = float(os.getenv('SENSOR_MAX_AGE', sensor.standby_time))
+reading = SingleFlight(sensor.fetch, SENSOR_MAX_AGE)
 con = DaikinAircon()
+ir = PipelinedIRClient if IR_PIPELINED else IRClient
+
+def watch_sensor(writer, recorder):
+    # a failure is printed and the loop goes on, so one broken sink
+    # does not stop the other
+    last = None
+    while True:
+        try:
+            values, fetched = reading()
+        except Exception:
+            traceback.print_exc()
+            fetched = last
+        if fetched != last:
+            now = time.time()
+            if writer:
+                try:
+                    writer.publish(values, now)
+                except Exception:
+                    traceback.print_exc()
+            if recorder:
+                try:
+                    recorder.append(now, values)
+                except Exception:
+                    traceback.print_exc()
+            last = fetched
+        time.sleep(sensor.standby_time)
+
+if SENSOR_SNAPSHOT or RECORD_DIR:
+    writer = SnapshotWriter(SENSOR_SNAPSHOT) if SENSOR_SNAPSHOT else None
+    recorder = Recorder(RECORD_DIR) if RECORD_DIR else None
+    threading.Thread(target=watch_sensor, args=(writer, recorder), daemon=True).start()
+
+if profiler.enabled:
+    sampler = profiler.Sampler()
+
+    def server_timing(callback):
+        def wrapper(*args, **kwargs):
+            with profiler.Timing() as timing:
+                body = callback(*args, **kwargs)
+            res = body if isinstance(body, HTTPResponse) else response
+            res.set_header('Server-Timing', timing.header())
+            return body
+        return wrapper
+
+    install(server_timing)
+
+    @put('/admin/profile')
+    def start_profile():
+        try:
+            seconds = float(request.forms.get('seconds', 10))
+        except ValueError:
+            return HTTPResponse({'error': 'invalid seconds'}, 400)
+        if not 0 < seconds <= 300:
+            return HTTPResponse({'error': 'seconds out of range'}, 400)
+        if sampler.running:
+            return HTTPResponse({'error': 'profiler already running'}, 409)
+        sampler.start(seconds)
+        return {'result': 'started'}
+
+    @get('/admin/profile')
+    def get_profile():
+        response.content_type = 'text/plain'
+        return sampler.collapsed()
 
 @get('/env')
 def env():
-    t, h, p = sensor.fetch()
+    (t, h, p), fetched = reading()
+    max_age = max(0, int(SENSOR_MAX_AGE - (time.monotonic() - fetched)))
+    headers = {
+        'ETag': '"{0:x}"'.format(hash((t, h, p)) & 0xffffffffffffffff),
+        'Cache-Control': 'max-age={0}'.format(max_age),
+    }
+    if request.headers.get('If-None-Match') == headers['ETag']:
+        return HTTPResponse(status=304, headers=headers)
+    for name, value in headers.items():
+        response.set_header(name, value)
     return { 'temp': t, 'humidity': h, 'pressure': p }
 
+if RECORD_DIR:
+    @get('/env/export')
+    def env_export():
+        try:
+            start = float(request.query['from']) if 'from' in request.query else None
+            end = float(request.query['to']) if 'to' in request.query else None
+        except ValueError:
+            return HTTPResponse({'error': 'invalid time range'}, 400)
+        fmt = request.query.get('format', 'csv')
+        if fmt == 'csv':
+            response.content_type = 'text/csv'
+            header = ['timestamp,temp,humidity,pressure\n']
+            line = '{0},{1},{2},{3}\n'
+        elif fmt == 'ndjson':
+            response.content_type = 'application/x-ndjson'
+            header = []
+            line = '{{"timestamp": {0}, "temp": {1}, "humidity": {2}, "pressure": {3}}}\n'
+        else:
+            return HTTPResponse({'error': 'invalid format'}, 400)
+
+        def export():
+            chunk = header
+            for record in records(RECORD_DIR, start, end):
+                chunk.append(line.format(*record))
+                if len(chunk) >= 1000:
+                    yield ''.join(chunk)
+                    chunk = []
+            yield ''.join(chunk)
+        return export()
+
 @put('/aircon')
 def aircon():
     try:
-        work = 'work' in request.forms
-        mode = request.forms['mode']
-        temp = int(request.forms['temp'])
+        with profiler.phase('parse'):
+            work = 'work' in request.forms
+            mode = request.forms['mode']
+            temp = int(request.forms['temp'])
     except KeyError as ex:
         return HTTPResponse({'error': "missing parameter: {0}".format(ex.args[0])}, 400)
 
     try:
-        code = con.pack(work=work, mode=mode, temp=temp)
-        IRClient.send(code, IR_WRITE_PIN, con.carrier_freq)
+        with profiler.phase('pack'):
+            code = con.pack(work=work, mode=mode, temp=temp)
+        ir.send(code, IR_WRITE_PIN, con.carrier_freq)
     except ValueError as ex:
         return HTTPResponse({'error': str(ex)}, 400)
     return {'result': 'success'}